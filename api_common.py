@@ -0,0 +1,272 @@
+import os
+import json
+import base64
+import hashlib
+import mmap
+import random
+import stat
+import textwrap
+import httpx
+from diskcache import Cache
+
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
+# API Keys from environment variables
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+MISTRAL_OCR_URL = "https://api.mistral.ai/v1/ocr"
+MISTRAL_FILES_URL = "https://api.mistral.ai/v1/files"
+
+# Shared HTTP/2 client settings: one TLS connection per host is reused and
+# multiplexed across requests instead of a new handshake per document
+HTTP_TIMEOUT = httpx.Timeout(5.0, read=120.0)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+# Transport retries only cover failed connection attempts; throttling and
+# server errors are retried by api_handler_async._post_with_retry so the two
+# layers don't multiply
+HTTP_RETRIES = 3
+
+# Content types of the supported document formats, by extension; the upload
+# widget and file validation in the app accept exactly these
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+# Upload limit for a base64-encoded document; base64 inflates files by ~4/3
+_MAX_ENCODED_SIZE_MB = 10
+_BASE64_OVERHEAD = 1.34
+
+# Responses worth retrying: throttling and transient server errors
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+def _private_cache_dir():
+    """
+    Create the result cache directory, readable only by the current user.
+    
+    The cache holds text extracted from medical claim documents, so it lives in
+    a per-user location (`CHAMPVA_CACHE_DIR`, or `champva_llm_cache` under the
+    user's cache directory) rather than a shared temp path.
+    
+    Returns:
+        str: Path to the cache directory
+        
+    Raises:
+        RuntimeError: If the directory is a symlink or owned by another user
+    """
+    directory = os.getenv("CHAMPVA_CACHE_DIR") or os.path.join(
+        os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "champva_llm_cache"
+    )
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or (hasattr(os, "getuid") and info.st_uid != os.getuid()):
+        raise RuntimeError(f"Refusing to use cache directory {directory}: it is not a directory owned by the current user")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+# Exact-match cache of OCR text and analysis results, so re-submitted
+# documents skip the API calls entirely
+llm_cache = Cache(_private_cache_dir(), size_limit=2**30)
+CACHE_TTL = 86400  # seconds
+
+# Dedented and stripped once so every request sends a byte-identical prefix,
+# which lets OpenAI's prompt cache serve it; only `input` varies per call
+SYSTEM_PROMPT = textwrap.dedent("""
+    You are an expert medical coder helping to validate CHAMPVA claim support documents.
+    
+    Analyze the provided document text and identify:
+    1. The document type (Superbill, EOB, or Pharmacy Receipt)
+    2. Whether all required medical codes are present and valid
+    3. Any missing or invalid medical codes
+    4. If the document is the wrong type
+    
+    Requirements for each document type:
+    - Superbill: Must contain CPT codes, ICD-10 diagnosis codes, and provider information
+    - EOB (Explanation of Benefits): Must contain CPT codes, dates of service, and payment information
+    - Pharmacy Receipt: Must contain NDC (National Drug Code), medication name, and cost information
+    
+    Respond with a JSON object in the following format:
+    {
+        "document_type": "Superbill|EOB|Pharmacy Receipt|Unknown",
+        "has_issues": true|false,
+        "missing_codes": ["list of missing code types"],
+        "invalid_codes": ["list of invalid codes found"],
+        "wrong_document_type": true|false,
+        "expected_type": "expected document type if wrong",
+        "errors": ["detailed error messages"],
+        "notes": "any additional notes or observations"
+    }
+    """).strip()
+
+_SYSTEM_PROMPT_BYTES = SYSTEM_PROMPT.encode("utf-8")
+
+# Batch instructions extend the single-document prompt so both share a prefix
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + "\n\n" + textwrap.dedent("""
+    The input contains several documents, each introduced by a "===DOC n===" line.
+    Analyze each document separately and respond with a JSON object of the form
+    {"results": [...]} holding one object in the format above per document, in document order.
+    """).strip()
+
+# Try using gpt-4.1 first, fallback to gpt-4.1-mini if it fails
+MODELS_TO_TRY = ("gpt-4.1", "gpt-4.1-mini", "gpt-4")
+_MODELS_TO_TRY_BYTES = "|".join(MODELS_TO_TRY).encode("utf-8")
+
+# Identifies the current prompts and model list, for callers that cache analysis results
+PROMPT_VERSION = hashlib.sha256(
+    _MODELS_TO_TRY_BYTES + b"|" + _SYSTEM_PROMPT_BYTES + b"|" + BATCH_SYSTEM_PROMPT.encode("utf-8")
+).hexdigest()
+
+def should_retry(status_code, body_text):
+    """Whether a failed response looks like throttling or a transient server error."""
+    return status_code in _RETRY_STATUSES or "rate limit" in body_text.lower()
+
+def retry_delay(response_headers, attempt, base, cap):
+    """Seconds to wait before the next attempt, honoring a Retry-After header."""
+    retry_after = response_headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return min(cap, base * 2 ** attempt + random.random() * 0.25)
+
+def check_file_size(file_path):
+    """
+    Reject empty or oversized documents before reading or encoding them.
+    
+    Args:
+        file_path: Path to the document file
+        
+    Raises:
+        ValueError: If the file is empty or too large once base64-encoded
+    """
+    raw_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    if raw_size_mb == 0:
+        raise ValueError("File is empty. Please upload a valid document.")
+    if raw_size_mb * _BASE64_OVERHEAD > _MAX_ENCODED_SIZE_MB:
+        raise ValueError(
+            f"File is too large ({raw_size_mb:.1f} MB, {raw_size_mb * _BASE64_OVERHEAD:.1f} MB after base64 encoding). "
+            f"Please use a smaller file (under {_MAX_ENCODED_SIZE_MB / _BASE64_OVERHEAD:.1f} MB)."
+        )
+
+def ocr_cache_key(file_path):
+    """Cache key for the OCR text of a document, based on its contents."""
+    with open(file_path, "rb") as file:
+        return "ocr:" + hashlib.file_digest(file, "sha256").hexdigest()
+
+def analysis_cache_key(extracted_text):
+    """Cache key for an analysis result, based on the models, prompt and text."""
+    return hashlib.sha256(
+        b"v1|" + _MODELS_TO_TRY_BYTES + b"|" + _SYSTEM_PROMPT_BYTES + b"|" + extracted_text.encode("utf-8")
+    ).hexdigest()
+
+def batch_input(texts):
+    """Join document texts into a single input, each introduced by a delimiter line."""
+    return "".join(f"\n\n===DOC {i}===\n{text}" for i, text in enumerate(texts, 1))
+
+def batch_results(result, count):
+    """Per-document results from a batch reply, or None if it is malformed."""
+    results = result.get("results") if isinstance(result, dict) else None
+    if isinstance(results, list) and len(results) == count and all(isinstance(r, dict) for r in results):
+        return results
+    return None
+
+def _file_ext(file_path):
+    """Lower-cased file extension of a path, without the leading dot."""
+    return os.path.splitext(file_path)[1][1:].lower()
+
+def _content_type(file_path):
+    """Determine the content type of a document from its file extension."""
+    file_ext = _file_ext(file_path)
+    return CONTENT_TYPES.get(file_ext) or f"image/{file_ext}"
+
+def check_file_type(file_path):
+    """
+    Reject documents whose extension the OCR API does not support.
+    
+    Args:
+        file_path: Path to the document file
+        
+    Raises:
+        ValueError: If the file extension is not supported
+    """
+    file_ext = _file_ext(file_path)
+    if file_ext not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported file type ({file_ext or 'no extension'}). Please use a PDF or image file.")
+
+def upload_files(file_path):
+    """
+    Build the multipart fields for uploading a document to Mistral's files API.
+    
+    The raw bytes are sent as-is, avoiding the base64 expansion of an inline
+    data URL. They are read up front so the request can be replayed on retry.
+    
+    Args:
+        file_path: Path to the document file
+        
+    Returns:
+        dict: `files` argument for the upload request
+    """
+    with open(file_path, "rb") as file:
+        file_bytes = file.read()
+    return {"file": (os.path.basename(file_path), file_bytes, _content_type(file_path))}
+
+def file_ocr_payload(file_id):
+    """Build the Mistral OCR request payload for a document uploaded to the files API."""
+    return {
+        "model": "mistral-ocr-latest",
+        "document": {
+            "type": "file",
+            "file_id": file_id
+        },
+        "include_image_base64": False
+    }
+
+def ocr_payload(file_path):
+    """
+    Build the Mistral OCR request payload with the document inlined as a base64 data URL.
+    
+    Args:
+        file_path: Path to the document file
+        
+    Returns:
+        dict: JSON payload for the OCR endpoint
+        
+    Raises:
+        ValueError: If the file cannot be mapped (e.g. it is empty)
+    """
+    # Map the file instead of reading it so the only full-size copy is the base64 bytes
+    with open(file_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            file_base64 = base64.b64encode(mapped)
+    
+    content_type = _content_type(file_path)
+    
+    # Build the data URL as bytes and decode once at the JSON boundary
+    document_url = (b"data:" + content_type.encode("ascii") + b";base64," + file_base64).decode("ascii")
+    del file_base64
+    
+    return {
+        "model": "mistral-ocr-latest",
+        "document": {
+            "type": "document_url",
+            "document_url": document_url
+        },
+        "include_image_base64": False
+    }
+
+def ocr_text(ocr):
+    """Join the markdown of every OCR page with double newlines."""
+    return "\n\n".join(p["markdown"] for p in ocr.get("pages", []))
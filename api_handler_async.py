@@ -0,0 +1,405 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from aiolimiter import AsyncLimiter
+from openai import AsyncOpenAI, APIStatusError, NotFoundError
+from api_common import (
+    MISTRAL_API_KEY,
+    OPENAI_API_KEY,
+    MISTRAL_OCR_URL,
+    MISTRAL_FILES_URL,
+    HTTP_TIMEOUT,
+    HTTP_LIMITS,
+    HTTP_RETRIES,
+    SYSTEM_PROMPT,
+    BATCH_SYSTEM_PROMPT,
+    MODELS_TO_TRY,
+    llm_cache,
+    CACHE_TTL,
+    check_file_type,
+    check_file_size,
+    ocr_cache_key,
+    analysis_cache_key,
+    batch_input,
+    batch_results,
+    upload_files,
+    file_ocr_payload,
+    ocr_payload,
+    ocr_text,
+    json_dumps,
+    json_loads,
+    should_retry,
+    retry_delay,
+)
+
+# Seconds to wait on a model before racing the next fallback model against it.
+# The default sits above gpt-4.1's normal p95 latency, so the fallback only
+# starts for stalled requests; every hedge pays for a second request, and a
+# low delay makes gpt-4.1-mini answer most documents
+OPENAI_HEDGE_DELAY = float(os.getenv("OPENAI_HEDGE_DELAY", "30"))
+
+# Concurrency and requests-per-second limits for each external service
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "4"))
+OCR_RPS = float(os.getenv("OCR_RPS", "5"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+OPENAI_RPS = float(os.getenv("OPENAI_RPS", "5"))
+
+# Every async API call in the process runs on one long-lived event loop, so
+# the limits below are shared by all Streamlit sessions and reruns rather
+# than reset by each asyncio.run()
+_loop = None
+_loop_lock = threading.Lock()
+
+_LIMITS = {
+    "ocr": (asyncio.Semaphore(OCR_MAX_CONCURRENCY), AsyncLimiter(OCR_RPS, 1)),
+    "openai": (asyncio.Semaphore(OPENAI_MAX_CONCURRENCY), AsyncLimiter(OPENAI_RPS, 1)),
+}
+
+# Blocking file reads, hashing, base64 encoding and disk cache I/O run on
+# this pool so they never stall the shared loop. It is kept apart from the
+# loop's default executor, which httpx needs for DNS lookups
+_blocking_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-handler-io")
+
+def _get_loop():
+    """Start the shared event loop in a daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="api-handler-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+def run(coro):
+    """
+    Run a coroutine on the shared event loop and wait for its result.
+
+    The coroutines in this module must run through `run()`, since the shared
+    client and limits belong to that loop. It may be called from any thread
+    other than the loop's own.
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the I/O pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    """
+    Create the shared HTTP/2 client on first use.
+
+    Only called from the shared loop, so it is never created twice.
+
+    Returns:
+        httpx.AsyncClient: Client reused by every request in the process
+    """
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        transport=httpx.AsyncHTTPTransport(http2=True, limits=HTTP_LIMITS, retries=HTTP_RETRIES)
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_openai_client():
+    """
+    Create the OpenAI client on first use rather than at import time.
+
+    It sends requests over the shared HTTP/2 client. The SDK's own retries
+    are turned off because `_create_response()` retries inside the limits.
+
+    Returns:
+        AsyncOpenAI: Client reused by every analysis request in the process
+    """
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_get_client(), max_retries=0)
+
+async def _post_with_retry(url, *, headers, service, max_attempts=3, base=1.0, cap=30.0, **kwargs):
+    """
+    POST a request, retrying with exponential backoff on throttling and transient errors.
+
+    Args:
+        url: Endpoint URL
+        headers: Request headers
+        service: Service whose limits apply to each attempt ("ocr" or "openai")
+        max_attempts: Maximum number of attempts
+        base: Base delay in seconds, doubled on each attempt
+        cap: Maximum delay in seconds
+        **kwargs: Request body arguments (`content`, `data`, `files`), which must be replayable
+
+    Returns:
+        httpx.Response: The final response; callers check its status code
+    """
+    semaphore, limiter = _LIMITS[service]
+    for attempt in range(max_attempts):
+        async with semaphore:
+            async with limiter:
+                response = await _get_client().post(url, headers=headers, **kwargs)
+        if (
+            response.status_code < 400
+            or attempt == max_attempts - 1
+            or not should_retry(response.status_code, response.text)
+        ):
+            return response
+        await asyncio.sleep(retry_delay(response.headers, attempt, base, cap))
+
+async def _create_response(*, max_attempts=3, base=1.0, cap=30.0, **kwargs):
+    """
+    Create a Responses API response, retrying with exponential backoff on
+    throttling and transient errors.
+
+    Args:
+        max_attempts: Maximum number of attempts
+        base: Base delay in seconds, doubled on each attempt
+        cap: Maximum delay in seconds
+        **kwargs: Arguments for `responses.create()`
+
+    Returns:
+        Response: The SDK response object
+
+    Raises:
+        APIStatusError: If the final attempt fails
+    """
+    semaphore, limiter = _LIMITS["openai"]
+    for attempt in range(max_attempts):
+        try:
+            async with semaphore:
+                async with limiter:
+                    return await _get_openai_client().responses.create(**kwargs)
+        except APIStatusError as e:
+            if attempt == max_attempts - 1 or not should_retry(e.status_code, e.response.text):
+                raise
+            await asyncio.sleep(retry_delay(e.response.headers, attempt, base, cap))
+
+async def _delete_uploaded_file(file_id):
+    """Remove an uploaded document from Mistral once OCR is done (best effort)."""
+    semaphore, limiter = _LIMITS["ocr"]
+    try:
+        async with semaphore:
+            async with limiter:
+                await _get_client().delete(
+                    f"{MISTRAL_FILES_URL}/{file_id}",
+                    headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"}
+                )
+    except httpx.HTTPError:
+        pass
+
+async def process_document_ocr_async(file_path):
+    """
+    Process a document using Mistral's OCR API to extract text.
+
+    Args:
+        file_path: Path to the document file
+
+    Returns:
+        str: Extracted text from the document
+
+    Raises:
+        ValueError: If API key is missing or API returns an error
+    """
+    if not MISTRAL_API_KEY:
+        raise ValueError("Mistral API key not found in environment variables")
+
+    check_file_type(file_path)
+    check_file_size(file_path)
+
+    cache_key = await _run_blocking(ocr_cache_key, file_path)
+    cached = await _run_blocking(llm_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    auth_headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}"}
+    headers = {
+        **auth_headers,
+        "Content-Type": "application/json"
+    }
+
+    # Upload the raw file and reference it by ID; fall back to an inline
+    # base64 data URL if the files API rejects the upload
+    upload = await _post_with_retry(
+        MISTRAL_FILES_URL, headers=auth_headers, service="ocr",
+        files=await _run_blocking(upload_files, file_path), data={"purpose": "ocr"}
+    )
+    if upload.status_code == 200:
+        file_id = json_loads(upload.content)["id"]
+        try:
+            response = await _post_with_retry(MISTRAL_OCR_URL, headers=headers, service="ocr", content=json_dumps(file_ocr_payload(file_id)))
+        finally:
+            await _delete_uploaded_file(file_id)
+    else:
+        content = await _run_blocking(lambda: json_dumps(ocr_payload(file_path)))
+        response = await _post_with_retry(MISTRAL_OCR_URL, headers=headers, service="ocr", content=content)
+
+    if response.status_code == 200:
+        extracted_text = ocr_text(json_loads(response.content))
+        if extracted_text:
+            await _run_blocking(llm_cache.set, cache_key, extracted_text, expire=CACHE_TTL)
+        return extracted_text
+    else:
+        raise ValueError(f"OCR API Error: {response.status_code} - {response.text}")
+
+async def _request_json_response(model, instructions, input_text):
+    """
+    Send a single Responses API request to one model and parse the JSON reply.
+
+    Args:
+        model: Model name
+        instructions: System instructions for the model
+        input_text: The input to analyze
+
+    Returns:
+        dict: Parsed JSON response, or None if the model is unavailable or
+        its reply is not valid JSON
+
+    Raises:
+        ValueError: If the API returns any other error
+    """
+    try:
+        response = await _create_response(
+            model=model,
+            instructions=instructions,
+            input=input_text,
+            temperature=0.3
+        )
+    except APIStatusError as e:
+        # An unknown or inaccessible model falls through to the next model
+        if isinstance(e, NotFoundError) or e.code == "model_not_found":
+            return None
+        raise ValueError(f"OpenAI API Error: {e.status_code} - {e.response.text}")
+
+    try:
+        # The response is available via output_text
+        return json_loads(response.output_text)
+    except json.JSONDecodeError:
+        return None
+
+async def _create_json_response(instructions, input_text):
+    """
+    Send a request to OpenAI's Responses API and parse the JSON reply,
+    falling back through `MODELS_TO_TRY`.
+
+    The request is hedged: if a model has not answered within
+    `OPENAI_HEDGE_DELAY` seconds, the next model is started alongside it and
+    the first valid JSON reply wins. Further fallbacks run one at a time, and
+    a model or parse failure moves to the next model straight away.
+
+    Args:
+        instructions: System instructions for the model
+        input_text: The input to analyze
+
+    Returns:
+        dict: Parsed JSON response
+
+    Raises:
+        ValueError: If the API returns an error or no model returns valid JSON
+    """
+    def start(model):
+        return asyncio.create_task(_request_json_response(model, instructions, input_text))
+
+    models = iter(MODELS_TO_TRY)
+    pending = {start(next(models))}
+    timeout = OPENAI_HEDGE_DELAY
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # No reply yet, so race the next model against the slow one
+                model = next(models, None)
+                if model is not None:
+                    pending.add(start(model))
+                timeout = None
+                continue
+
+            for task in done:
+                result = task.result()
+                if result is not None:
+                    return result
+
+            # Every running model failed; fall back to the next one
+            if not pending:
+                model = next(models, None)
+                if model is not None:
+                    pending.add(start(model))
+    finally:
+        for task in pending:
+            task.cancel()
+
+    # If all models fail, raise an exception
+    raise ValueError("Failed to analyze document with all available models.")
+
+async def analyze_document_content_async(extracted_text):
+    """
+    Analyze the document content using OpenAI's Responses API to check for missing or invalid medical codes.
+
+    Args:
+        extracted_text: The extracted text from the document
+
+    Returns:
+        dict: Analysis results
+
+    Raises:
+        ValueError: If API key is missing or API returns an error
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not found in environment variables")
+
+    cache_key = analysis_cache_key(extracted_text)
+    cached = await _run_blocking(llm_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    result = await _create_json_response(SYSTEM_PROMPT, extracted_text)
+    await _run_blocking(llm_cache.set, cache_key, result, expire=CACHE_TTL)
+    return result
+
+async def analyze_documents_batch_async(texts):
+    """
+    Analyze several documents with a single Responses API call.
+
+    Documents that are already cached are not resent. If only one document
+    needs analysis, or the batch reply is malformed, each document is
+    analyzed with `analyze_document_content_async()` instead.
+
+    Args:
+        texts: The extracted text of each document
+
+    Returns:
+        list: Analysis results, in the same order as `texts`
+
+    Raises:
+        ValueError: If API key is missing or API returns an error
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not found in environment variables")
+
+    cache_keys = [analysis_cache_key(text) for text in texts]
+    results = await _run_blocking(lambda: [llm_cache.get(key) for key in cache_keys])
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    if len(pending) > 1:
+        batch = batch_results(
+            await _create_json_response(BATCH_SYSTEM_PROMPT, batch_input([texts[i] for i in pending])),
+            len(pending)
+        )
+        if batch is not None:
+            for i, result in zip(pending, batch):
+                results[i] = result
+            def store():
+                for i in pending:
+                    llm_cache.set(cache_keys[i], results[i], expire=CACHE_TTL)
+            await _run_blocking(store)
+            return results
+
+    analyzed = await asyncio.gather(*(analyze_document_content_async(texts[i]) for i in pending))
+    for i, result in zip(pending, analyzed):
+        results[i] = result
+    return results
@@ -1,9 +1,12 @@
 import streamlit as st
+import hashlib
 import os
-import base64
+import shutil
 import tempfile
-from utils import validate_file_type, determine_document_type, format_results
-from api_handler import process_document_ocr, analyze_document_content
+from concurrent.futures import ThreadPoolExecutor
+from utils import validate_file_type, format_results
+from api_common import CONTENT_TYPES, PROMPT_VERSION
+from api_handler_async import run, process_document_ocr_async, analyze_documents_batch_async
 
 st.set_page_config(
     page_title="CHAMPVA Document Validator",
@@ -11,6 +14,83 @@ st.set_page_config(
     layout="wide"
 )
 
+class _NoTextExtracted(Exception):
+    """Raised for an empty OCR result so `st.cache_data` does not memoize it."""
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _cached_ocr(file_digest, ext, _file_path):
+    """
+    Extract text from a document, memoized by its content hash and extension.
+    
+    Streamlit cannot cache coroutines, so this blocks on the API handler's
+    shared loop; call it from the script thread or a thread of its own,
+    never from that loop or its executor. Arguments starting with an
+    underscore are not part of the cache key.
+    
+    Returns:
+        str: Extracted text from the document
+        
+    Raises:
+        _NoTextExtracted: If no text was extracted, like the disk cache, an
+        empty result is not kept
+    """
+    text = run(process_document_ocr_async(_file_path))
+    if not text:
+        raise _NoTextExtracted()
+    return text
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _cached_analyze(texts, prompt_version):
+    """
+    Analyze extracted texts in one batch, memoized by the texts and prompt version.
+    
+    Blocks on the shared loop like `_cached_ocr()`.
+    
+    Returns:
+        list: Analysis results, in the same order as `texts`
+    """
+    return run(analyze_documents_batch_async(list(texts)))
+
+def _process_all(documents):
+    """
+    Extract text from every document concurrently, then analyze all of the
+    extracted texts with a single batched request.
+    
+    The cached wrappers block until the shared loop finishes each request,
+    so OCR fans out over a thread pool owned by this call. Blocking one of
+    the loop's own executor threads instead could starve the DNS lookups
+    that its requests need.
+    
+    Args:
+        documents: (content hash, path) of each saved document
+        
+    Returns:
+        list: One analysis result, None (no text extracted), or exception per document, in order
+    """
+    with ThreadPoolExecutor(max_workers=len(documents)) as pool:
+        futures = [
+            pool.submit(_cached_ocr, file_digest, os.path.splitext(path)[1].lower(), path)
+            for file_digest, path in documents
+        ]
+    outcomes = [future.exception() or future.result() for future in futures]
+    
+    # Only documents with extracted text go on to analysis
+    extracted = [(i, text) for i, text in enumerate(outcomes) if isinstance(text, str)]
+    outcomes = [
+        None if isinstance(outcome, (str, _NoTextExtracted)) else outcome
+        for outcome in outcomes
+    ]
+    
+    if extracted:
+        try:
+            results = _cached_analyze(tuple(text for _, text in extracted), PROMPT_VERSION)
+        except Exception as e:
+            results = [e] * len(extracted)
+        for (i, _), result in zip(extracted, results):
+            outcomes[i] = result
+    
+    return outcomes
+
 def main():
     st.title("CHAMPVA Claim Document Validator")
     
@@ -38,7 +118,7 @@ def main():
     
     uploaded_files = st.file_uploader(
         "Upload your CHAMPVA claim-support documents (max 3 files)",
-        type=["pdf", "jpg", "jpeg", "png"],
+        type=list(CONTENT_TYPES),
         accept_multiple_files=True,
         key="document_uploader"
     )
@@ -67,57 +147,61 @@ def main():
             st.session_state.processing = True
             
             with st.spinner("Processing your documents... This may take a moment."):
-                # Process each document
-                for file in uploaded_files:
-                    try:
-                        # Validate file
-                        if not validate_file_type(file):
-                            st.error(f"Invalid file type for {file.name}. Only PDF and image formats are supported.")
-                            continue
-                        
-                        # Create a temporary file to save the uploaded file
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.name.split('.')[-1]}") as temp_file:
-                            temp_file.write(file.getvalue())
-                            temp_file_path = temp_file.name
-                        
-                        # Extract text with OCR
-                        with st.spinner(f"Processing {file.name}..."):
-                            try:
-                                st.write("Extracting text with OCR...")
-                                extracted_text = process_document_ocr(temp_file_path)
-                                
-                                if not extracted_text:
-                                    st.error(f"Failed to extract text from {file.name}")
-                                    continue
-                                
-                                st.write("Analyzing document content...")
-                                # Analyze the document with OpenAI
-                                analysis_result = analyze_document_content(extracted_text)
-                                
-                                # Determine document type
-                                doc_type = determine_document_type(analysis_result)
-                                
-                                # Add to results with filename
-                                result = {
-                                    "filename": file.name,
-                                    "document_type": doc_type,
-                                    "analysis": analysis_result
-                                }
-                                st.session_state.results.append(result)
-                                st.write(f"Completed processing {file.name}")
-                                
-                            except ValueError as ve:
-                                st.error(f"Error processing {file.name}: {str(ve)}")
-                                continue
-                            except Exception as e:
-                                st.error(f"Unexpected error processing {file.name}: {str(e)}")
+                # Save each valid document to a temporary file
+                temp_paths = []
+                pending = []
+                outcomes = []
+                try:
+                    for file in uploaded_files:
+                        try:
+                            # Validate file
+                            if not validate_file_type(file):
+                                st.error(f"Invalid file type for {file.name}. Only PDF and image formats are supported.")
                                 continue
+                            
+                            # Create a temporary file to save the uploaded file
+                            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.name.split('.')[-1]}") as temp_file:
+                                # Track the path first so a failed copy is still cleaned up
+                                temp_paths.append(temp_file.name)
+                                file.seek(0)
+                                shutil.copyfileobj(file, temp_file, length=1024 * 1024)
+                            file_digest = hashlib.file_digest(file, "sha256").hexdigest()
+                            pending.append((file, file_digest, temp_file.name))
                         
-                        # Clean up temporary file
-                        os.unlink(temp_file_path)
+                        except Exception as e:
+                            st.error(f"Error processing {file.name}: {str(e)}")
                     
-                    except Exception as e:
-                        st.error(f"Error processing {file.name}: {str(e)}")
+                    # Extract text and analyze all documents concurrently
+                    if pending:
+                        st.write("Extracting text with OCR and analyzing document content...")
+                        outcomes = _process_all([(file_digest, path) for _, file_digest, path in pending])
+                finally:
+                    # Clean up temporary files
+                    for temp_file_path in temp_paths:
+                        os.unlink(temp_file_path)
+                
+                # Report per-document outcomes once every task has finished
+                for (file, _, _), outcome in zip(pending, outcomes):
+                    if isinstance(outcome, ValueError):
+                        st.error(f"Error processing {file.name}: {str(outcome)}")
+                    elif isinstance(outcome, BaseException):
+                        st.error(f"Unexpected error processing {file.name}: {str(outcome)}")
+                    elif outcome is None:
+                        st.error(f"Failed to extract text from {file.name}")
+                    elif not isinstance(outcome, dict):
+                        st.error(f"Error processing {file.name}: the analysis did not return a JSON object")
+                    else:
+                        # Determine document type
+                        doc_type = outcome.get("document_type", "Unknown")
+                        
+                        # Add to results with filename
+                        result = {
+                            "filename": file.name,
+                            "document_type": doc_type,
+                            "analysis": outcome
+                        }
+                        st.session_state.results.append(result)
+                        st.write(f"Completed processing {file.name}")
             
             st.session_state.processing = False
             st.success("Document processing complete!")
@@ -1,4 +1,9 @@
-import streamlit as st
+from api_common import CONTENT_TYPES
+
+# Accepted upload types; the extensions cover browsers that report no MIME type,
+# and some browsers report JPEGs as the non-standard image/jpg
+_VALID_MIME = frozenset(CONTENT_TYPES.values()) | {"image/jpg"}
+_VALID_EXTS = tuple(f".{ext}" for ext in CONTENT_TYPES)
 
 def validate_file_type(file):
     """
@@ -10,19 +15,8 @@ def validate_file_type(file):
     Returns:
         bool: True if file type is valid, False otherwise
     """
-    valid_types = [
-        'application/pdf',
-        'image/jpeg', 
-        'image/jpg',
-        'image/png'
-    ]
-    
-    # Check for PDF extension if mimetype detection fails
-    if file.type not in valid_types:
-        if file.name.lower().endswith('.pdf'):
-            return True
-        return False
-    return True
+    # Fall back to the file extension if mimetype detection fails
+    return file.type in _VALID_MIME or file.name.lower().endswith(_VALID_EXTS)
 
 def determine_document_type(analysis_result):
     """
@@ -50,46 +44,44 @@ def format_results(result):
     Returns:
         str: Formatted results in markdown format
     """
-    formatted_text = ""
+    parts = []
     
     # Document type
     doc_type = result.get("document_type", "Unknown")
-    formatted_text += f"**Document Type**: {doc_type}\n\n"
+    parts.append(f"**Document Type**: {doc_type}\n\n")
     
     # Document validity
     analysis = result.get("analysis", {})
     has_issues = analysis.get("has_issues", True)
     
     if not has_issues:
-        formatted_text += "✅ **Status**: This document appears to be valid with proper medical codes.\n\n"
+        parts.append("✅ **Status**: This document appears to be valid with proper medical codes.\n\n")
     else:
-        formatted_text += "❌ **Status**: Issues found in this document.\n\n"
+        parts.append("❌ **Status**: Issues found in this document.\n\n")
     
     # Missing codes
     missing_codes = analysis.get("missing_codes", [])
     if missing_codes:
-        formatted_text += "**Missing Codes**:\n"
-        for code in missing_codes:
-            formatted_text += f"- {code}\n"
-        formatted_text += "\n"
+        parts.append("**Missing Codes**:\n")
+        parts.extend(f"- {code}\n" for code in missing_codes)
+        parts.append("\n")
     
     # Invalid codes
     invalid_codes = analysis.get("invalid_codes", [])
     if invalid_codes:
-        formatted_text += "**Invalid Codes**:\n"
-        for code in invalid_codes:
-            formatted_text += f"- {code}\n"
-        formatted_text += "\n"
+        parts.append("**Invalid Codes**:\n")
+        parts.extend(f"- {code}\n" for code in invalid_codes)
+        parts.append("\n")
     
     # Wrong document type
     wrong_doc_type = analysis.get("wrong_document_type", False)
     if wrong_doc_type:
         expected_type = analysis.get("expected_type", "Unknown")
-        formatted_text += f"**Wrong Document Type**: This does not appear to be a {expected_type} document.\n\n"
+        parts.append(f"**Wrong Document Type**: This does not appear to be a {expected_type} document.\n\n")
     
     # Additional notes
     notes = analysis.get("notes", "")
     if notes:
-        formatted_text += f"**Notes**: {notes}\n\n"
+        parts.append(f"**Notes**: {notes}\n\n")
     
-    return formatted_text
+    return "".join(parts)